@@ -0,0 +1,120 @@
+"""
+Mongo-backed cache for LLM responses.
+
+Entries are keyed by a SHA-256 hash of the canonicalized request. Callers that
+supply a prompt embedding can additionally fall back to a cosine-similarity scan
+over the most recent entries in the same scope, so near-identical prompts are
+served without another model call.
+"""
+
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import numpy as np
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TTL = 604800  # 7 days
+SEMANTIC_SCAN_LIMIT = 500
+SEMANTIC_THRESHOLD = 0.97
+
+_collection = None
+
+
+def init(database):
+    """Bind the cache to the application database"""
+    global _collection
+    _collection = database.llm_cache
+
+
+async def ensure_indexes():
+    await _collection.create_index([("input_hash", 1), ("prompt_version", 1)])
+    await _collection.create_index([("prompt_version", 1), ("scope", 1), ("created_at", -1)])
+    await _collection.create_index("expires_at", expireAfterSeconds=0)
+
+
+def make_key(prompt_version: str, *parts: str) -> str:
+    """Hash the request parts after collapsing insignificant whitespace"""
+    canonical = "|".join(" ".join(part.split()) for part in (prompt_version, *parts))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+async def get(input_hash: str, prompt_version: str) -> Optional[str]:
+    """Return the cached response for an exact request match"""
+    try:
+        entry = await _collection.find_one(
+            {
+                "input_hash": input_hash,
+                "prompt_version": prompt_version,
+                "expires_at": {"$gt": datetime.now(timezone.utc)}
+            },
+            {"value": 1}
+        )
+    except PyMongoError as e:
+        logger.warning(f"LLM cache lookup failed: {str(e)}")
+        return None
+
+    return entry["value"] if entry else None
+
+
+async def get_similar(embedding: List[float], prompt_version: str, scope: str) -> Optional[str]:
+    """Return the cached response whose prompt embedding is closest to `embedding`, if close enough"""
+    try:
+        entries = await _collection.find(
+            {
+                "prompt_version": prompt_version,
+                "scope": scope,
+                "embedding": {"$exists": True},
+                "expires_at": {"$gt": datetime.now(timezone.utc)}
+            },
+            {"value": 1, "embedding": 1}
+        ).sort("created_at", -1).to_list(SEMANTIC_SCAN_LIMIT)
+    except PyMongoError as e:
+        logger.warning(f"LLM cache similarity scan failed: {str(e)}")
+        return None
+
+    if not entries:
+        return None
+
+    matrix = np.stack([np.frombuffer(entry["embedding"], dtype=np.float32) for entry in entries])
+    query = np.asarray(embedding, dtype=np.float32)
+    scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query))
+
+    best = int(np.argmax(scores))
+    if scores[best] < SEMANTIC_THRESHOLD:
+        return None
+    return entries[best]["value"]
+
+
+async def set(
+    input_hash: str,
+    prompt_version: str,
+    value: str,
+    scope: Optional[str] = None,
+    embedding: Optional[List[float]] = None,
+    ttl: int = DEFAULT_TTL
+):
+    """Store a response; embeddings are kept as packed float32 to keep similarity scans cheap"""
+    now = datetime.now(timezone.utc)
+    entry = {
+        "input_hash": input_hash,
+        "prompt_version": prompt_version,
+        "value": value,
+        "scope": scope,
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=ttl)
+    }
+    if embedding is not None:
+        entry["embedding"] = np.asarray(embedding, dtype=np.float32).tobytes()
+
+    try:
+        await _collection.update_one(
+            {"input_hash": input_hash, "prompt_version": prompt_version},
+            {"$set": entry},
+            upsert=True
+        )
+    except PyMongoError as e:
+        logger.warning(f"LLM cache store failed: {str(e)}")
@@ -1,44 +1,112 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import StreamingResponse
-from dotenv import load_dotenv
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from dotenv import load_dotenv, dotenv_values
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any
-import uuid
-from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any, AsyncIterator, Tuple
+from uuid6 import uuid7
+from datetime import datetime, timedelta, timezone
 import jwt
 import bcrypt
 from slugify import slugify
 import hashlib
-import json
+from blake3 import blake3
+import orjson
+import re
 import asyncio
-from io import BytesIO
+import time
+import tempfile
+from cachetools import TTLCache
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import markdown
-from pypdf import PdfReader
-from docx import Document
-from emergentintegrations.llm.chat import LlmChat, UserMessage
+import httpx
+from openai import AsyncOpenAI
+import llm_cache
+from text_extraction import extract_text
 
 # Setup
 ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+ENV_PATH = ROOT_DIR / '.env'
+load_dotenv(ENV_PATH)
+
+# Parsed .env contents, so settings writes only touch the file when a value changes
+_ENV_CACHE: Dict[str, Optional[str]] = dotenv_values(ENV_PATH)
+_ENV_LOCK = asyncio.Lock()
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    tz_aware=True,
+    maxPoolSize=int(os.environ.get('MONGO_POOL', '50')),
+    minPoolSize=5,
+    waitQueueTimeoutMS=5000,
+    serverSelectionTimeoutMS=3000
+)
 db = client[os.environ['DB_NAME']]
+llm_cache.init(db)
 
 # Auth setup
 security = HTTPBearer()
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
 JWT_ALGORITHM = "HS256"
+# Key bytes and the JWS signer are built once; claims are serialized with orjson in create_jwt_token
+_JWT_KEY = JWT_SECRET.encode()
+_JWS = jwt.PyJWS()
+
+# Verified bearer tokens -> (exp, user), so repeat requests skip JWT verification and the user lookup
+_TOKEN_CACHE = TTLCache(maxsize=10_000, ttl=60)
+
+# Document signatures. Records without signature_algo used sha256, but cannot be re-verified:
+# their hash timestamp and signed_at came from separate clock reads, and signed_at lost its
+# microseconds in storage. Only signatures made with millisecond-truncated now_utc() verify.
+SIGNATURE_ALGO = "blake3"
+BLAKE3_THREADING_BYTES = 1 << 20
+
+# bcrypt work factor; 10 keeps dev registration/login fast, production deployments should set 12
+BCRYPT_COST = int(os.environ.get('BCRYPT_COST', '10'))
+
+# LLM setup
+# Bump PROMPT_VERSION whenever a system prompt changes so cached responses are invalidated
+PROMPT_VERSION = "v2"
+CHAT_MODEL = "gpt-4o"
+EMBEDDING_MODEL = "text-embedding-3-small"
+LLM_CACHE_SEMANTIC = os.environ.get('LLM_CACHE_SEMANTIC', 'false').lower() == 'true'
+
+# One pooled HTTP/2 connection set shared by every OpenAI call
+_OPENAI_HTTP = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+)
+_openai: Optional[AsyncOpenAI] = None
+
+MAX_UPLOAD_BYTES = 20 * 1024 * 1024  # 20MB limit
+UPLOAD_CHUNK_BYTES = 1 << 20
+
+# CPU-bound upload parsing runs in worker processes so it never blocks the event loop
+def new_process_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn"))
+
+PROCESS_POOL = new_process_pool()
+
+# Document titles come from the first heading (or sentence) near the top of generated content
+_TITLE_RE = re.compile(r'^#+\s*(.+)$', re.MULTILINE)
+_TITLE_STRIP_RE = re.compile(r'[#*_`]')
+TITLE_SCAN_CHARS = 512
+
+# Server-sent events must not be buffered by reverse proxies
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
 
 # Create the main app
-app = FastAPI(title="Accredis API", version="1.0.0")
+app = FastAPI(title="Accredis API", version="1.0.0", default_response_class=ORJSONResponse)
 api_router = APIRouter(prefix="/api")
 
 # Logging
@@ -97,17 +165,19 @@ class DocumentStatus(str):
     PUBLISHED = "published"
     ARCHIVED = "archived"
 
-class DocumentBase(BaseModel):
+class DocumentMeta(BaseModel):
     title: str
     category: str  # policy, procedure, checklist, risk_assessment
-    content: str
     jurisdiction: str  # national, NSW, VIC, QLD, SA, WA, TAS, NT, ACT
     tags: List[str] = []
+
+class DocumentBase(DocumentMeta):
+    content: str
     
 class DocumentCreate(DocumentBase):
     clinic_id: str
 
-class DocumentResponse(DocumentBase):
+class DocumentSummaryResponse(DocumentMeta):  # list views omit the content body
     id: str
     clinic_id: str
     status: str = DocumentStatus.DRAFT
@@ -116,9 +186,16 @@ class DocumentResponse(DocumentBase):
     created_at: datetime
     updated_at: datetime
     signature_hash: Optional[str] = None
+    signature_algo: Optional[str] = None
     signed_by: Optional[str] = None
     signed_at: Optional[datetime] = None
 
+class DocumentResponse(DocumentSummaryResponse):
+    content: str
+
+class DocumentStatusBatch(BaseModel):
+    transitions: List[str]  # applied in order, e.g. ["review", "published"]
+
 class DocumentGenerationRequest(BaseModel):
     prompt: str
     category: str = "policy"
@@ -157,57 +234,115 @@ class AuditResult(BaseModel):
 # UTILITIES
 # ===========================
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+def now_utc() -> datetime:
+    """Request-scoped timestamp; FastAPI resolves a dependency once per request, so all writes share it"""
+    # BSON stores milliseconds; truncating up front keeps signed instants identical after a round trip
+    dt = datetime.now(timezone.utc)
+    return dt.replace(microsecond=dt.microsecond // 1000 * 1000)
 
-def verify_password(password: str, hashed: str) -> bool:
+def new_id() -> str:
+    """Time-ordered UUIDv7 so inserts append to the end of the `id` indexes"""
+    return str(uuid7())
+
+def _hash_password_sync(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_COST)).decode('utf-8')
+
+def _verify_password_sync(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+async def hash_password(password: str) -> str:
+    """Hash a password in the default executor so bcrypt does not stall the event loop"""
+    return await asyncio.get_running_loop().run_in_executor(None, _hash_password_sync, password)
+
+async def verify_password(password: str, hashed: str) -> bool:
+    return await asyncio.get_running_loop().run_in_executor(None, _verify_password_sync, password, hashed)
+
 def create_jwt_token(user_id: str, clinic_id: Optional[str] = None) -> str:
     payload = {
         "user_id": user_id,
         "clinic_id": clinic_id,
-        "exp": datetime.utcnow() + timedelta(days=7)
+        "exp": int((datetime.now(timezone.utc) + timedelta(days=7)).timestamp())
     }
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    return _JWS.encode(orjson.dumps(payload), _JWT_KEY, algorithm=JWT_ALGORITHM)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    token = credentials.credentials
+    cached = _TOKEN_CACHE.get(token)
+    if cached is not None:
+        exp, user = cached
+        if exp > time.time():
+            return user
+        _TOKEN_CACHE.pop(token, None)
+        raise HTTPException(status_code=401, detail="Token expired")
+    
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user_id = payload.get("user_id")
-        if not user_id:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        user = await db.users.find_one({"id": user_id})
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-        
-        return user
+        payload = jwt.decode(token, _JWT_KEY, algorithms=[JWT_ALGORITHM])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    
+    user_id = payload.get("user_id")
+    if not user_id:
         raise HTTPException(status_code=401, detail="Invalid token")
+    
+    user = await db.users.find_one({"id": user_id})
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    
+    if "exp" in payload:
+        _TOKEN_CACHE[token] = (payload["exp"], user)
+    return user
 
-def create_document_hash(content: str, user_id: str, timestamp: datetime) -> str:
-    """Create SHA-256 hash for digital signature"""
-    data = f"{content}{user_id}{timestamp.isoformat()}"
-    return hashlib.sha256(data.encode()).hexdigest()
+def invalidate_user_tokens(user_id: str):
+    """Drop cached tokens for a user whose record changed"""
+    for token, (_, user) in list(_TOKEN_CACHE.items()):
+        if user["id"] == user_id:
+            _TOKEN_CACHE.pop(token, None)
 
-async def generate_ai_document(prompt: str, jurisdiction: str, category: str) -> str:
-    """Generate document using AI"""
+def create_document_hash(content: str, user_id: str, timestamp: datetime, algo: str = SIGNATURE_ALGO) -> str:
+    """Create hash for digital signature; pass the stored signature_algo and signed_at to verify one"""
+    data = content.encode()
+    if algo == "blake3":
+        # Multithreaded hashing only pays off for large inputs
+        hasher = blake3(max_threads=blake3.AUTO if len(data) >= BLAKE3_THREADING_BYTES else 1)
+    elif algo == "sha256":
+        hasher = hashlib.sha256()
+    else:
+        raise ValueError(f"Unsupported signature algorithm: {algo}")
+    
+    hasher.update(data)
+    hasher.update(f"{user_id}{timestamp.isoformat()}".encode())
+    return hasher.hexdigest()
+
+def openai_client() -> AsyncOpenAI:
+    """Shared OpenAI client, rebuilt only when the configured API key changes"""
+    global _openai
+    api_key = os.environ.get('OPENAI_API_KEY')
+    if _openai is None or _openai.api_key != api_key:
+        _openai = AsyncOpenAI(api_key=api_key, http_client=_OPENAI_HTTP)
+    return _openai
+
+async def embed_prompt(prompt: str) -> Optional[List[float]]:
+    """Embed a prompt for semantic cache matching; returns None when disabled or on failure"""
+    if not LLM_CACHE_SEMANTIC:
+        return None
+    
     try:
-        # Get API key from environment
-        api_key = os.environ.get('OPENAI_API_KEY')
-        if not api_key:
-            raise HTTPException(status_code=500, detail="AI service not configured")
-        
-        # Create jurisdiction-aware system message
-        system_message = f"""You are an expert in Australian healthcare compliance and policy writing for General Practice clinics.
+        response = await openai_client().embeddings.create(model=EMBEDDING_MODEL, input=prompt)
+        return response.data[0].embedding
+    except Exception as e:
+        logger.warning(f"Prompt embedding failed: {str(e)}")
+        return None
 
-Generate a comprehensive {category} document for {jurisdiction} jurisdiction that complies with:
+# System prompts are kept free of per-request values so OpenAI can reuse the cached prefix;
+# jurisdiction and category travel in the user message instead
+SYSTEM_PREAMBLE_GEN = """You are an expert in Australian healthcare compliance and policy writing for General Practice clinics.
+
+Generate a comprehensive document of the requested category for the requested jurisdiction that complies with:
 - RACGP Standards for General Practices 5th Edition
 - National Vaccine Storage Guidelines (Strive for 5)
-- State-specific regulations for {jurisdiction}
+- State-specific regulations for the requested jurisdiction
 
 Format the response as a structured policy document with:
 1. Title
@@ -218,36 +353,15 @@ Format the response as a structured policy document with:
 6. References to relevant standards
 7. Review requirements
 
-Make it specific to Australian General Practice operations and include relevant compliance references."""
+Make it specific to Australian General Practice operations and include relevant compliance references.
 
-        # Initialize AI chat
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"doc_gen_{uuid.uuid4()}",
-            system_message=system_message
-        ).with_model("openai", "gpt-4o").with_max_tokens(4096)
-        
-        user_message = UserMessage(text=prompt)
-        response = await chat.send_message(user_message)
-        
-        return response
-        
-    except Exception as e:
-        logger.error(f"AI document generation failed: {str(e)}")
-        raise HTTPException(status_code=500, detail="Document generation failed")
+The user's message starts with the jurisdiction and document category, followed by their requirements."""
 
-async def audit_document(content: str, jurisdiction: str) -> AuditResult:
-    """Audit document for compliance"""
-    try:
-        api_key = os.environ.get('OPENAI_API_KEY')
-        if not api_key:
-            raise HTTPException(status_code=500, detail="AI service not configured")
-        
-        system_message = f"""You are an expert compliance auditor for Australian General Practice clinics.
+SYSTEM_PREAMBLE_AUDIT = """You are an expert compliance auditor for Australian General Practice clinics.
 
 Audit the provided document against:
 - RACGP Standards for General Practices 5th Edition
-- {jurisdiction} specific healthcare regulations
+- Healthcare regulations specific to the requested jurisdiction
 - Best practices for GP clinic operations
 
 Provide a detailed compliance analysis with:
@@ -256,42 +370,149 @@ Provide a detailed compliance analysis with:
 3. Recommendations for improvement
 4. RACGP standard coverage assessment
 
-Return the analysis in JSON format."""
+Return the analysis in JSON format.
+
+The user's message starts with the jurisdiction, followed by the document to audit."""
+
+def generation_user_message(prompt: str, jurisdiction: str, category: str) -> str:
+    return f"Jurisdiction: {jurisdiction}\nCategory: {category}\n\n{prompt}"
+
+def audit_user_message(content: str, jurisdiction: str) -> str:
+    return f"Jurisdiction: {jurisdiction}\n\nAudit this document:\n\n{content}"
+
+def chat_messages(system_message: str, user_text: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": user_text}
+    ]
+
+async def complete_chat(system_message: str, user_text: str, max_tokens: int) -> str:
+    """Run a completion and return the full response text"""
+    response = await openai_client().chat.completions.create(
+        model=CHAT_MODEL,
+        max_tokens=max_tokens,
+        messages=chat_messages(system_message, user_text)
+    )
+    return response.choices[0].message.content or ""
+
+async def stream_chat(system_message: str, user_text: str, max_tokens: int) -> AsyncIterator[str]:
+    """Stream completion deltas as they arrive"""
+    stream = await openai_client().chat.completions.create(
+        model=CHAT_MODEL,
+        max_tokens=max_tokens,
+        stream=True,
+        messages=chat_messages(system_message, user_text)
+    )
+    async for chunk in stream:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+async def smooth(
+    source: AsyncIterator[str],
+    max_chunk: int = 4,
+    delay: float = 0.02,
+    burst_threshold: int = 50,
+    max_spread: float = 0.25
+) -> AsyncIterator[str]:
+    """Re-chunk bursty deltas into small, evenly paced pieces; small deltas pass through untouched"""
+    async for delta in source:
+        if len(delta) <= burst_threshold:
+            yield delta
+            continue
+        
+        # Cap the pacing per burst so the client never falls far behind the model
+        pieces = [delta[i:i + max_chunk] for i in range(0, len(delta), max_chunk)]
+        pause = min(delay, max_spread / len(pieces))
+        for i, piece in enumerate(pieces):
+            if i:
+                await asyncio.sleep(pause)
+            yield piece
+
+def generation_scope(clinic_id: str, category: str, jurisdiction: str) -> str:
+    """Semantic-cache scope; per clinic, since near-identical prompts often differ only in clinic details"""
+    return f"generate|{clinic_id}|{category}|{jurisdiction}"
 
-        chat = LlmChat(
-            api_key=api_key,
-            session_id=f"audit_{uuid.uuid4()}",
-            system_message=system_message
-        ).with_model("openai", "gpt-4o").with_max_tokens(2048)
+async def cached_generation(input_hash: str, prompt: str, scope: str) -> Tuple[Optional[str], Optional[List[float]]]:
+    """Look up a generated document, returning (cached response, prompt embedding for storing a miss)"""
+    cached = await llm_cache.get(input_hash, PROMPT_VERSION)
+    if cached is not None:
+        return cached, None
+    
+    embedding = await embed_prompt(prompt)
+    if embedding is not None:
+        cached = await llm_cache.get_similar(embedding, PROMPT_VERSION, scope)
+    return cached, embedding
+
+async def generate_ai_document(prompt: str, jurisdiction: str, category: str, clinic_id: str) -> str:
+    """Generate document using AI"""
+    try:
+        if not os.environ.get('OPENAI_API_KEY'):
+            raise HTTPException(status_code=500, detail="AI service not configured")
         
-        user_message = UserMessage(text=f"Audit this document:\n\n{content}")
-        response = await chat.send_message(user_message)
+        # Serve repeat requests from the cache, falling back to near-identical prompts
+        input_hash = llm_cache.make_key(PROMPT_VERSION, category, jurisdiction, prompt)
+        scope = generation_scope(clinic_id, category, jurisdiction)
+        cached, embedding = await cached_generation(input_hash, prompt, scope)
+        if cached is not None:
+            return cached
         
-        # Parse AI response (simplified for MVP)
-        return AuditResult(
-            document_id="",
-            score=85.0,  # Default score - in production, parse AI response
-            compliance_issues=[],
-            recommendations=["Review and update annually", "Ensure staff training"],
-            racgp_coverage={"Standard_1": True, "Standard_2": True}
-        )
+        user_text = generation_user_message(prompt, jurisdiction, category)
+        response = await complete_chat(SYSTEM_PREAMBLE_GEN, user_text, 4096)
+        
+        await llm_cache.set(input_hash, PROMPT_VERSION, response, scope=scope, embedding=embedding)
+        return response
+        
+    except Exception as e:
+        logger.error(f"AI document generation failed: {str(e)}")
+        raise HTTPException(status_code=500, detail="Document generation failed")
+
+async def audit_document(content: str, jurisdiction: str) -> AuditResult:
+    """Audit document for compliance"""
+    try:
+        if not os.environ.get('OPENAI_API_KEY'):
+            raise HTTPException(status_code=500, detail="AI service not configured")
+        
+        input_hash = llm_cache.make_key(PROMPT_VERSION, "audit", jurisdiction, content)
+        response = await llm_cache.get(input_hash, PROMPT_VERSION)
+        
+        if response is None:
+            response = await complete_chat(SYSTEM_PREAMBLE_AUDIT, audit_user_message(content, jurisdiction), 2048)
+            await llm_cache.set(input_hash, PROMPT_VERSION, response, scope=f"audit|{jurisdiction}")
+        
+        return parse_audit_response(response)
         
     except Exception as e:
         logger.error(f"Document audit failed: {str(e)}")
         raise HTTPException(status_code=500, detail="Document audit failed")
 
+def parse_audit_response(response: str) -> AuditResult:
+    """Convert the raw audit response into an AuditResult"""
+    # Parse AI response (simplified for MVP)
+    return AuditResult(
+        document_id="",
+        score=85.0,  # Default score - in production, parse AI response
+        compliance_issues=[],
+        recommendations=["Review and update annually", "Ensure staff training"],
+        racgp_coverage={"Standard_1": True, "Standard_2": True}
+    )
+
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Format a server-sent event frame"""
+    frame = f"data: {orjson.dumps(data).decode()}\n\n"
+    return f"event: {event}\n{frame}" if event else frame
+
 # ===========================
 # AUTHENTICATION ROUTES
 # ===========================
 
 @api_router.post("/auth/register", response_model=TokenResponse)
-async def register(user_data: UserCreate):
+async def register(user_data: UserCreate, now: datetime = Depends(now_utc)):
     # Check if user exists
     if await db.users.find_one({"email": user_data.email}):
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    user_id = str(uuid.uuid4())
-    hashed_password = hash_password(user_data.password)
+    user_id = new_id()
+    hashed_password = await hash_password(user_data.password)
     
     user_doc = {
         "id": user_id,
@@ -301,11 +522,15 @@ async def register(user_data: UserCreate):
         "role": user_data.role,
         "clinic_id": user_data.clinic_id,
         "password_hash": hashed_password,
-        "created_at": datetime.utcnow(),
+        "created_at": now,
         "is_active": True
     }
     
-    await db.users.insert_one(user_doc)
+    # The unique email index settles concurrent registrations that both passed the check above
+    try:
+        await db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     token = create_jwt_token(user_id, user_data.clinic_id)
     user_response = UserResponse(**{k: v for k, v in user_doc.items() if k != "password_hash"})
@@ -315,7 +540,7 @@ async def register(user_data: UserCreate):
 @api_router.post("/auth/login", response_model=TokenResponse)
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user["password_hash"]):
+    if not user or not await verify_password(credentials.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     if not user.get("is_active", True):
@@ -335,8 +560,12 @@ async def get_current_user_info(current_user=Depends(get_current_user)):
 # ===========================
 
 @api_router.post("/clinics", response_model=ClinicResponse)
-async def create_clinic(clinic_data: ClinicCreate, current_user=Depends(get_current_user)):
-    clinic_id = str(uuid.uuid4())
+async def create_clinic(
+    clinic_data: ClinicCreate,
+    current_user=Depends(get_current_user),
+    now: datetime = Depends(now_utc)
+):
+    clinic_id = new_id()
     clinic_slug = slugify(clinic_data.name)
     
     clinic_doc = {
@@ -349,7 +578,7 @@ async def create_clinic(clinic_data: ClinicCreate, current_user=Depends(get_curr
         "phone": clinic_data.phone,
         "email": clinic_data.email,
         "owner_id": current_user["id"],
-        "created_at": datetime.utcnow()
+        "created_at": now
     }
     
     await db.clinics.insert_one(clinic_doc)
@@ -359,6 +588,7 @@ async def create_clinic(clinic_data: ClinicCreate, current_user=Depends(get_curr
         {"id": current_user["id"]},
         {"$set": {"clinic_id": clinic_id}}
     )
+    invalidate_user_tokens(current_user["id"])
     
     return ClinicResponse(**clinic_doc)
 
@@ -382,37 +612,61 @@ async def get_user_clinics(current_user=Depends(get_current_user)):
     
     return [ClinicResponse(**clinic) for clinic in clinics]
 
-# ===========================
-# DOCUMENT MANAGEMENT
-# ===========================
+def has_clinic_access(clinic: dict, user: dict) -> bool:
+    """Owners and members of a clinic may act on its documents"""
+    return clinic["owner_id"] == user["id"] or clinic["id"] == user.get("clinic_id")
 
-@api_router.post("/documents/generate", response_model=DocumentResponse)
-async def generate_document(request: DocumentGenerationRequest, current_user=Depends(get_current_user)):
-    # Verify clinic access
-    clinic = await db.clinics.find_one({"id": request.clinic_id})
+async def load_clinic_for_user(clinic_id: str, current_user: dict) -> dict:
+    clinic = await db.clinics.find_one({"id": clinic_id})
     if not clinic:
         raise HTTPException(status_code=404, detail="Clinic not found")
+    if not has_clinic_access(clinic, current_user):
+        raise HTTPException(status_code=403, detail="Not authorized for this clinic")
+    return clinic
+
+async def load_document_for_user(doc_id: str, current_user: dict) -> dict:
+    """Fetch a document joined with its clinic in one round-trip and check access"""
+    docs = await db.documents.aggregate([
+        {"$match": {"id": doc_id}},
+        {"$limit": 1},
+        {"$lookup": {"from": "clinics", "localField": "clinic_id", "foreignField": "id", "as": "clinic"}}
+    ]).to_list(1)
+    if not docs:
+        raise HTTPException(status_code=404, detail="Document not found")
     
-    # Generate AI content
-    ai_content = await generate_ai_document(request.prompt, request.jurisdiction, request.category)
-    
-    # Create document
-    doc_id = str(uuid.uuid4())
+    doc = docs[0]
+    clinics = doc.pop("clinic")
+    if not clinics or not has_clinic_access(clinics[0], current_user):
+        raise HTTPException(status_code=403, detail="Not authorized for this document")
+    return doc
+
+# ===========================
+# DOCUMENT MANAGEMENT
+# ===========================
+
+def build_generated_document(
+    request: DocumentGenerationRequest,
+    ai_content: str,
+    current_user: dict,
+    now: datetime
+) -> dict:
+    """Build the document record for AI-generated content"""
+    doc_id = new_id()
     
     # Extract title from AI content - look for the first heading
-    import re
-    title_match = re.search(r'^#+\s*(.+)$', ai_content, re.MULTILINE)
+    head = ai_content[:TITLE_SCAN_CHARS]
+    title_match = _TITLE_RE.search(head)
     if title_match:
         extracted_title = title_match.group(1).strip()
     else:
         # Fallback to first sentence if no heading found
-        sentences = ai_content.split('.')
-        extracted_title = sentences[0][:100] + "..." if len(sentences[0]) > 100 else sentences[0]
+        first_sentence = head.split('.', 1)[0]
+        extracted_title = first_sentence[:100] + "..." if len(first_sentence) > 100 else first_sentence
         
     # Clean up any markdown formatting from title
-    extracted_title = re.sub(r'[#*_`]', '', extracted_title).strip()
+    extracted_title = _TITLE_STRIP_RE.sub('', extracted_title).strip()
     
-    doc = {
+    return {
         "id": doc_id,
         "title": extracted_title,
         "content": ai_content,
@@ -423,14 +677,66 @@ async def generate_document(request: DocumentGenerationRequest, current_user=Dep
         "version": 1,
         "tags": [],
         "created_by": current_user["id"],
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow()
+        "created_at": now,
+        "updated_at": now
     }
+
+@api_router.post("/documents/generate", response_model=DocumentResponse)
+async def generate_document(
+    request: DocumentGenerationRequest,
+    current_user=Depends(get_current_user),
+    now: datetime = Depends(now_utc)
+):
+    # Verify clinic access
+    await load_clinic_for_user(request.clinic_id, current_user)
+    
+    # Generate AI content
+    ai_content = await generate_ai_document(request.prompt, request.jurisdiction, request.category, request.clinic_id)
     
+    # Create document
+    doc = build_generated_document(request, ai_content, current_user, now)
     await db.documents.insert_one(doc)
     return DocumentResponse(**doc)
 
-@api_router.get("/documents", response_model=List[DocumentResponse])
+@api_router.post("/documents/generate/stream")
+async def generate_document_stream(
+    request: DocumentGenerationRequest,
+    current_user=Depends(get_current_user),
+    now: datetime = Depends(now_utc)
+):
+    """Generate a document, streaming content deltas as SSE and finishing with a `done` event"""
+    await load_clinic_for_user(request.clinic_id, current_user)
+    
+    if not os.environ.get('OPENAI_API_KEY'):
+        raise HTTPException(status_code=500, detail="AI service not configured")
+    
+    async def events():
+        try:
+            input_hash = llm_cache.make_key(PROMPT_VERSION, request.category, request.jurisdiction, request.prompt)
+            scope = generation_scope(request.clinic_id, request.category, request.jurisdiction)
+            ai_content, embedding = await cached_generation(input_hash, request.prompt, scope)
+            
+            if ai_content is not None:
+                yield sse_event({"delta": ai_content})
+            else:
+                chunks = []
+                user_text = generation_user_message(request.prompt, request.jurisdiction, request.category)
+                async for delta in smooth(stream_chat(SYSTEM_PREAMBLE_GEN, user_text, 4096)):
+                    chunks.append(delta)
+                    yield sse_event({"delta": delta})
+                ai_content = "".join(chunks)
+                await llm_cache.set(input_hash, PROMPT_VERSION, ai_content, scope=scope, embedding=embedding)
+            
+            doc = build_generated_document(request, ai_content, current_user, now)
+            await db.documents.insert_one(doc)
+            yield sse_event({"document_id": doc["id"]}, event="done")
+        except Exception as e:
+            logger.error(f"AI document generation failed: {str(e)}")
+            yield sse_event({"detail": "Document generation failed"}, event="error")
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@api_router.get("/documents", response_model=List[DocumentSummaryResponse])
 async def get_documents(
     clinic_id: Optional[str] = None,
     status: Optional[str] = None,
@@ -441,17 +747,22 @@ async def get_documents(
     
     # Filter by clinic if specified
     if clinic_id:
+        if clinic_id != current_user.get("clinic_id"):
+            await load_clinic_for_user(clinic_id, current_user)
         query["clinic_id"] = clinic_id
     elif current_user.get("clinic_id"):
         query["clinic_id"] = current_user["clinic_id"]
+    else:
+        # Without a clinic of their own, callers only see the clinics they own
+        query["clinic_id"] = {"$in": await db.clinics.distinct("id", {"owner_id": current_user["id"]})}
     
     if status:
         query["status"] = status
     if category:
         query["category"] = category
     
-    documents = await db.documents.find(query).sort("created_at", -1).to_list(100)
-    return [DocumentResponse(**doc) for doc in documents]
+    documents = await db.documents.find(query, {"content": 0}).sort("created_at", -1).to_list(100)
+    return [DocumentSummaryResponse(**doc) for doc in documents]
 
 @api_router.get("/documents/{doc_id}", response_model=DocumentResponse)
 async def get_document(doc_id: str, current_user=Depends(get_current_user)):
@@ -461,68 +772,145 @@ async def get_document(doc_id: str, current_user=Depends(get_current_user)):
     
     return DocumentResponse(**doc)
 
-@api_router.put("/documents/{doc_id}/status")
-async def update_document_status(
-    doc_id: str,
-    status: str,
-    current_user=Depends(get_current_user)
-):
-    valid_statuses = [DocumentStatus.DRAFT, DocumentStatus.REVIEW, DocumentStatus.PUBLISHED, DocumentStatus.ARCHIVED]
-    if status not in valid_statuses:
-        raise HTTPException(status_code=400, detail="Invalid status")
-    
-    doc = await db.documents.find_one({"id": doc_id})
-    if not doc:
-        raise HTTPException(status_code=404, detail="Document not found")
-    
+VALID_DOCUMENT_STATUSES = [DocumentStatus.DRAFT, DocumentStatus.REVIEW, DocumentStatus.PUBLISHED, DocumentStatus.ARCHIVED]
+
+def status_update_fields(doc: dict, status: str, current_user: dict, now: datetime) -> dict:
+    """Fields to set when a document moves to `status`"""
     update_data = {
         "status": status,
-        "updated_at": datetime.utcnow()
+        "updated_at": now
     }
     
     # If publishing, add digital signature
     if status == DocumentStatus.PUBLISHED:
-        signature_hash = create_document_hash(doc["content"], current_user["id"], datetime.utcnow())
+        signature_hash = create_document_hash(doc["content"], current_user["id"], now)
         update_data.update({
             "signature_hash": signature_hash,
+            "signature_algo": SIGNATURE_ALGO,
             "signed_by": current_user["id"],
-            "signed_at": datetime.utcnow()
+            "signed_at": now
         })
     
-    await db.documents.update_one({"id": doc_id}, {"$set": update_data})
-    return {"message": "Document status updated", "status": status}
+    return update_data
 
-@api_router.post("/documents/{doc_id}/audit", response_model=AuditResult)
-async def audit_document_endpoint(doc_id: str, current_user=Depends(get_current_user)):
+@api_router.put("/documents/{doc_id}/status")
+async def update_document_status(
+    doc_id: str,
+    status: str,
+    current_user=Depends(get_current_user),
+    now: datetime = Depends(now_utc)
+):
+    if status not in VALID_DOCUMENT_STATUSES:
+        raise HTTPException(status_code=400, detail="Invalid status")
+    
     doc = await db.documents.find_one({"id": doc_id})
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    audit_result = await audit_document(doc["content"], doc["jurisdiction"])
-    audit_result.document_id = doc_id
+    update_data = status_update_fields(doc, status, current_user, now)
+    await db.documents.update_one({"id": doc_id}, {"$set": update_data})
+    return {"message": "Document status updated", "status": status}
+
+@api_router.post("/documents/{doc_id}/status:batch")
+async def update_document_status_batch(
+    doc_id: str,
+    batch: DocumentStatusBatch,
+    current_user=Depends(get_current_user),
+    now: datetime = Depends(now_utc)
+):
+    """Apply an ordered list of status transitions with a single read and write"""
+    if not batch.transitions or any(transition not in VALID_DOCUMENT_STATUSES for transition in batch.transitions):
+        raise HTTPException(status_code=400, detail="Invalid status")
     
-    # Store audit result
+    doc = await load_document_for_user(doc_id, current_user)
+    
+    # Later transitions override earlier ones; a publish anywhere in the batch keeps its signature
+    update_data = {}
+    for transition in batch.transitions:
+        update_data.update(status_update_fields(doc, transition, current_user, now))
+    
+    await db.documents.update_one({"id": doc_id}, {"$set": update_data})
+    return {"message": "Document status updated", "status": update_data["status"]}
+
+async def store_audit(audit_result: AuditResult, current_user: dict, now: datetime):
+    """Persist an audit result against its document"""
     audit_doc = {
-        "id": str(uuid.uuid4()),
-        "document_id": doc_id,
+        "id": new_id(),
+        "document_id": audit_result.document_id,
         "score": audit_result.score,
         "compliance_issues": audit_result.compliance_issues,
         "recommendations": audit_result.recommendations,
         "racgp_coverage": audit_result.racgp_coverage,
         "audited_by": current_user["id"],
-        "audited_at": datetime.utcnow()
+        "audited_at": now
     }
     await db.audits.insert_one(audit_doc)
+
+@api_router.post("/documents/{doc_id}/audit", response_model=AuditResult)
+async def audit_document_endpoint(
+    doc_id: str,
+    current_user=Depends(get_current_user),
+    now: datetime = Depends(now_utc)
+):
+    doc = await load_document_for_user(doc_id, current_user)
+    
+    audit_result = await audit_document(doc["content"], doc["jurisdiction"])
+    audit_result.document_id = doc_id
+    
+    # Store audit result
+    await store_audit(audit_result, current_user, now)
     
     return audit_result
 
+@api_router.post("/documents/{doc_id}/audit/stream")
+async def audit_document_stream(
+    doc_id: str,
+    current_user=Depends(get_current_user),
+    now: datetime = Depends(now_utc)
+):
+    """Audit a document, streaming the raw analysis as SSE and finishing with the AuditResult"""
+    doc = await load_document_for_user(doc_id, current_user)
+    
+    if not os.environ.get('OPENAI_API_KEY'):
+        raise HTTPException(status_code=500, detail="AI service not configured")
+    
+    async def events():
+        try:
+            input_hash = llm_cache.make_key(PROMPT_VERSION, "audit", doc["jurisdiction"], doc["content"])
+            response = await llm_cache.get(input_hash, PROMPT_VERSION)
+            
+            if response is not None:
+                yield sse_event({"delta": response})
+            else:
+                chunks = []
+                user_text = audit_user_message(doc["content"], doc["jurisdiction"])
+                async for delta in smooth(stream_chat(SYSTEM_PREAMBLE_AUDIT, user_text, 2048)):
+                    chunks.append(delta)
+                    yield sse_event({"delta": delta})
+                response = "".join(chunks)
+                await llm_cache.set(input_hash, PROMPT_VERSION, response, scope=f"audit|{doc['jurisdiction']}")
+            
+            audit_result = parse_audit_response(response)
+            audit_result.document_id = doc_id
+            await store_audit(audit_result, current_user, now)
+            yield sse_event(audit_result.model_dump(), event="done")
+        except Exception as e:
+            logger.error(f"Document audit failed: {str(e)}")
+            yield sse_event({"detail": "Document audit failed"}, event="error")
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 # ===========================
 # RISK MANAGEMENT
 # ===========================
 
 @api_router.post("/risks", response_model=RiskResponse)
-async def create_risk(risk_data: RiskCreate, current_user=Depends(get_current_user)):
-    risk_id = str(uuid.uuid4())
+async def create_risk(
+    risk_data: RiskCreate,
+    current_user=Depends(get_current_user),
+    now: datetime = Depends(now_utc)
+):
+    risk_id = new_id()
     risk_doc = {
         "id": risk_id,
         "title": risk_data.title,
@@ -536,8 +924,8 @@ async def create_risk(risk_data: RiskCreate, current_user=Depends(get_current_us
         "status": "open",
         "owner_id": current_user["id"],
         "linked_docs": [],
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow()
+        "created_at": now,
+        "updated_at": now
     }
     
     await db.risks.insert_one(risk_doc)
@@ -558,35 +946,55 @@ async def get_risks(clinic_id: Optional[str] = None, current_user=Depends(get_cu
 # FILE UPLOAD & PROCESSING
 # ===========================
 
+async def spool_upload(file: UploadFile) -> str:
+    """Copy an upload to a temporary file in chunks, rejecting it as soon as it exceeds the size limit"""
+    spool = tempfile.NamedTemporaryFile(delete=False)
+    try:
+        with spool:
+            size = 0
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(status_code=400, detail="File too large")
+                spool.write(chunk)
+    except BaseException:
+        os.unlink(spool.name)
+        raise
+    return spool.name
+
 @api_router.post("/documents/upload")
 async def upload_document(
     file: UploadFile = File(...),
     clinic_id: str = Form(...),
     category: str = Form("policy"),
     jurisdiction: str = Form("national"),
-    current_user=Depends(get_current_user)
+    current_user=Depends(get_current_user),
+    now: datetime = Depends(now_utc)
 ):
-    if file.size > 20 * 1024 * 1024:  # 20MB limit
+    if file.size and file.size > MAX_UPLOAD_BYTES:
         raise HTTPException(status_code=400, detail="File too large")
     
-    # Read file content
-    content = await file.read()
-    extracted_text = ""
-    
+    global PROCESS_POOL
+    upload_path = await spool_upload(file)
+    pool = PROCESS_POOL
     try:
-        if file.content_type == "application/pdf":
-            pdf_reader = PdfReader(BytesIO(content))
-            extracted_text = "\n".join([page.extract_text() for page in pdf_reader.pages])
-        elif file.content_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            doc = Document(BytesIO(content))
-            extracted_text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-        else:
-            extracted_text = content.decode('utf-8')
+        extracted_text = await asyncio.get_running_loop().run_in_executor(
+            pool, extract_text, upload_path, file.content_type
+        )
+    except BrokenProcessPool:
+        # A worker died mid-parse (OOM, parser crash); a broken pool rejects all later work, so replace it once
+        logger.error(f"Upload parser worker died while processing {file.filename}; restarting process pool")
+        if PROCESS_POOL is pool:
+            PROCESS_POOL = new_process_pool()
+            pool.shutdown(wait=False)
+        raise HTTPException(status_code=500, detail="Failed to process file")
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to process file: {str(e)}")
+    finally:
+        os.unlink(upload_path)
     
     # Create document
-    doc_id = str(uuid.uuid4())
+    doc_id = new_id()
     doc = {
         "id": doc_id,
         "title": file.filename,
@@ -598,8 +1006,8 @@ async def upload_document(
         "version": 1,
         "tags": ["uploaded"],
         "created_by": current_user["id"],
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow()
+        "created_at": now,
+        "updated_at": now
     }
     
     await db.documents.insert_one(doc)
@@ -609,6 +1017,33 @@ async def upload_document(
 # SETTINGS MANAGEMENT
 # ===========================
 
+def write_env_value(key: str, value: str):
+    """Update or add a key in the backend .env file, replacing the file atomically"""
+    lines = ENV_PATH.read_text().splitlines(keepends=True) if ENV_PATH.exists() else []
+    entry = f'{key}="{value}"\n'
+    
+    for i, line in enumerate(lines):
+        if line.startswith(f'{key}='):
+            lines[i] = entry
+            break
+    else:
+        if lines and not lines[-1].endswith('\n'):
+            lines[-1] += '\n'
+        lines.append(entry)
+    
+    # mkstemp creates the file 0600; an existing .env keeps its own mode across the replace
+    fd, tmp_path = tempfile.mkstemp(dir=ENV_PATH.parent, prefix='.env.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.writelines(lines)
+        if ENV_PATH.exists():
+            os.chmod(tmp_path, ENV_PATH.stat().st_mode & 0o7777)
+        os.replace(tmp_path, ENV_PATH)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    _ENV_CACHE[key] = value
+
 @api_router.post("/settings")
 async def save_settings(settings: dict, current_user=Depends(get_current_user)):
     """Save user/clinic settings - for MVP, we'll update the backend .env file with API key"""
@@ -618,29 +1053,14 @@ async def save_settings(settings: dict, current_user=Depends(get_current_user)):
             # In production, this should be encrypted per-clinic in database
             api_key = settings['openai_api_key']
             
-            # Update .env file
-            env_path = ROOT_DIR / '.env'
-            with open(env_path, 'r') as f:
-                lines = f.readlines()
-            
-            # Update or add OPENAI_API_KEY
-            key_found = False
-            for i, line in enumerate(lines):
-                if line.startswith('OPENAI_API_KEY='):
-                    lines[i] = f'OPENAI_API_KEY="{api_key}"\n'
-                    key_found = True
-                    break
-            
-            if not key_found:
-                lines.append(f'OPENAI_API_KEY="{api_key}"\n')
-            
-            with open(env_path, 'w') as f:
-                f.writelines(lines)
+            # Update .env file only when the key actually changed
+            async with _ENV_LOCK:
+                if _ENV_CACHE.get('OPENAI_API_KEY') != api_key:
+                    write_env_value('OPENAI_API_KEY', api_key)
+                    logger.info(f"Updated OpenAI API key for user {current_user['id']}")
             
             # Update environment variable for current session
             os.environ['OPENAI_API_KEY'] = api_key
-            
-            logger.info(f"Updated OpenAI API key for user {current_user['id']}")
         
         return {"message": "Settings saved successfully"}
         
@@ -666,13 +1086,16 @@ async def get_settings(current_user=Depends(get_current_user)):
 # Include router
 app.include_router(api_router)
 
-# CORS
+# CORS - credentialed requests require explicit origins; browsers reject "*" with credentials
+CORS_ORIGINS = [origin.strip() for origin in os.environ.get('CORS_ORIGINS', 'https://app.accredis.com').split(',') if origin.strip()]
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=CORS_ORIGINS,
+    allow_methods=["GET", "POST", "PUT", "DELETE"],
+    allow_headers=["Authorization", "Content-Type"],
+    max_age=86400,
 )
 
 # Configure logging
@@ -681,6 +1104,30 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
+async def create_unique_index(collection, keys):
+    """Create a unique index, logging rather than failing startup if existing data has duplicates"""
+    try:
+        await collection.create_index(keys, unique=True)
+    except OperationFailure as e:
+        if e.code != 11000:
+            raise
+        # Left uncreated until the duplicates are merged; the next startup after that builds it
+        logger.error(f"Duplicate values in {collection.name}.{keys}; unique index not created: {str(e)}")
+
+@app.on_event("startup")
+async def create_indexes():
+    await create_unique_index(db.users, "email")
+    await create_unique_index(db.users, "id")
+    await create_unique_index(db.clinics, [("id", 1)])
+    await db.clinics.create_index("owner_id")
+    await create_unique_index(db.documents, "id")
+    await db.documents.create_index([("clinic_id", 1), ("created_at", -1)])
+    await db.documents.create_index([("clinic_id", 1), ("status", 1), ("category", 1)])
+    await db.risks.create_index([("clinic_id", 1), ("risk_score", -1)])
+    await llm_cache.ensure_indexes()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+    await _OPENAI_HTTP.aclose()
+    PROCESS_POOL.shutdown(wait=False, cancel_futures=True)
\ No newline at end of file
@@ -0,0 +1,26 @@
+"""
+Text extraction for uploaded documents.
+
+Kept separate from server.py so process-pool workers only import the parsers,
+not the web application and its database client.
+"""
+
+from docx import Document
+from pypdf import PdfReader
+
+PDF_CONTENT_TYPE = "application/pdf"
+DOCX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+def extract_text(path: str, content_type: str) -> str:
+    """Extract plain text from a PDF, DOCX or UTF-8 text file on disk"""
+    if content_type == PDF_CONTENT_TYPE:
+        pdf_reader = PdfReader(path)
+        return "\n".join([page.extract_text() or "" for page in pdf_reader.pages])
+    elif content_type == DOCX_CONTENT_TYPE:
+        doc = Document(path)
+        return "\n".join([paragraph.text for paragraph in doc.paragraphs])
+    else:
+        # newline='' keeps the upload's original line endings
+        with open(path, encoding='utf-8', newline='') as f:
+            return f.read()
@@ -4,83 +4,306 @@ Comprehensive Backend API Testing for Accredis Application
 Tests all endpoints including auth, clinics, documents, risks, and settings
 """
 
-import requests
+import argparse
+import asyncio
+import os
 import sys
-import json
+import httpx
+import ijson
+import orjson
+import pytest
+import random
+import sqlite3
+import time
+import uuid
+import vcr
 from datetime import datetime
-from typing import Dict, Any, Optional
+from pathlib import Path
+from typing import AsyncIterator, Awaitable, Callable, Dict, Any, List, NamedTuple, Optional, Tuple
+
+DEFAULT_BASE_URL = "https://3a613ff7-04b5-4966-bd61-71f63dc3a56f.preview.emergentagent.com"
+
+CASSETTE_DIR = Path(__file__).parent / 'fixtures' / 'cassettes'
+
+# Opt-in local cache of GET responses (ACC_CACHE=1); keep it off in CI. Entries are per user and
+# per URL, so hits across runs need ACCREDIS_TEST_EMAIL and ACCREDIS_TEST_CLINIC_ID set
+CACHE_PATH = Path(__file__).parent / 'acc_tests.sqlite'
+CACHE_TTL = 300
+
+# (connect, read) timeouts in seconds; 3.05 sits just past a TCP retransmit window.
+# AI-backed endpoints send nothing until the model finishes, so they get a longer read timeout.
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 30
+AI_READ_TIMEOUT = 180
+
+# Upper bound on in-flight requests; also sizes the client's connection pool
+MAX_CONCURRENCY = 8
+
+# Transient failures are retried with capped, fully jittered exponential backoff
+MAX_ATTEMPTS = 3
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+RETRY_STATUSES = {429, 502, 503, 504}
+# A POST that reached the server may have taken effect, so it is only re-sent on 429 or a failed connect
+IDEMPOTENT_METHODS = {'GET', 'PUT', 'DELETE'}
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Seconds to wait before the next attempt, honoring a numeric Retry-After header"""
+    if retry_after and retry_after.isdigit():
+        return min(BACKOFF_CAP, float(retry_after))
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+class AsyncByteReader:
+    """Adapts an httpx byte stream to the async read() interface ijson consumes"""
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self._chunks = chunks
+
+    async def read(self, size: int = -1) -> bytes:
+        # ijson probes the stream type with read(0) before parsing; that probe must not consume a chunk
+        if size == 0:
+            return b''
+        return await anext(self._chunks, b'')
+
+async def read_top_level_keys(response: httpx.Response, keys: Tuple[str, ...]) -> Dict[str, Any]:
+    """Parse the body incrementally, keeping only the listed top-level keys"""
+    found = {}
+    async for key, value in ijson.kvitems(AsyncByteReader(response.aiter_bytes()), '', use_float=True):
+        if key in keys:
+            found[key] = value
+            if len(found) == len(keys):
+                break
+    return found
+
+async def read_snippet(response: httpx.Response, limit: int = 512) -> str:
+    """Read just enough of the body to show the first `limit` bytes"""
+    snippet = b''
+    async for chunk in response.aiter_bytes():
+        snippet += chunk
+        if len(snippet) >= limit:
+            break
+    return snippet[:limit].decode(errors='replace')
+
+class ResponseCache:
+    """SQLite cache of successful GET responses, scoped by the endpoint's top-level resource"""
+    def __init__(self, path: Path = CACHE_PATH, ttl: int = CACHE_TTL):
+        self.ttl = ttl
+        # Bumped on every invalidation, so a GET that overlapped a write doesn't store a pre-write snapshot
+        self._generations: Dict[str, int] = {}
+        self._db = sqlite3.connect(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, scope TEXT, body BLOB, stored_at REAL)"
+        )
+        self._db.execute("DELETE FROM responses WHERE stored_at < ?", (time.time() - ttl,))
+        self._db.commit()
+
+    @staticmethod
+    def key(user: str, url: str, params: Optional[Dict], keys: Optional[Tuple[str, ...]]) -> str:
+        return orjson.dumps([user, url, params, keys], option=orjson.OPT_SORT_KEYS).decode()
+
+    def lookup(self, key: str) -> Optional[Any]:
+        row = self._db.execute(
+            "SELECT body FROM responses WHERE key = ? AND stored_at >= ?", (key, time.time() - self.ttl)
+        ).fetchone()
+        return orjson.loads(row[0]) if row else None
+
+    def generation(self, scope: str) -> int:
+        return self._generations.get(scope, 0)
+
+    def store(self, key: str, scope: str, value: Any, generation: int):
+        if generation != self.generation(scope):
+            return
+        self._db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, scope, orjson.dumps(value), time.time())
+        )
+        self._db.commit()
+
+    def invalidate(self, scope: str):
+        self._generations[scope] = self.generation(scope) + 1
+        self._db.execute("DELETE FROM responses WHERE scope = ?", (scope,))
+        self._db.commit()
+
+class Node(NamedTuple):
+    """A test and the names of the tests that must pass before it runs"""
+    name: str
+    deps: Tuple[str, ...]
+    fn: Callable[[], Awaitable[bool]]
 
 class AccredisAPITester:
-    def __init__(self, base_url: str = "https://3a613ff7-04b5-4966-bd61-71f63dc3a56f.preview.emergentagent.com"):
+    def __init__(self, base_url: str = DEFAULT_BASE_URL):
         self.base_url = base_url
         self.api_url = f"{base_url}/api"
-        self.token = None
+        self._token = None
         self.user_data = None
         self.clinic_id = None
         self.document_id = None
         self.risk_id = None
         self.tests_run = 0
         self.tests_passed = 0
+        self.tests_skipped = 0
+        
+        # Report lines are buffered and written once, so concurrent tests don't interleave per-line writes
+        self._log: list[str] = []
+        
+        self._slots = asyncio.Semaphore(MAX_CONCURRENCY)
+        self.cache: Optional[ResponseCache] = ResponseCache() if os.environ.get('ACC_CACHE') == '1' else None
+        
+        # Opened by run_all_tests or the pytest fixture
+        self.client: Optional[httpx.AsyncClient] = None
         
         # Test data
-        self.test_timestamp = datetime.now().strftime('%H%M%S')
+        # Unique per run and per pytest-xdist worker, since workers start within the same second
+        worker = os.environ.get('PYTEST_XDIST_WORKER', 'main')
+        self.run_id = f"{datetime.now():%H%M%S}{worker}{uuid.uuid4().hex[:8]}"
         self.test_user = {
-            "email": f"testuser{self.test_timestamp}@example.com",
+            "email": f"testuser{self.run_id}@example.com",
             "password": "TestPass123!",
             "first_name": "Test",
             "last_name": "User",
             "role": "manager"
         }
+        
+        # A persistent account (and optionally clinic) skips the registration and clinic-creation round-trips
+        env_email = os.environ.get('ACCREDIS_TEST_EMAIL')
+        env_password = os.environ.get('ACCREDIS_TEST_PASSWORD')
+        self._skip_registration = bool(env_email and env_password)
+        if self._skip_registration:
+            self.test_user.update(email=env_email, password=env_password)
+            self.clinic_id = os.environ.get('ACCREDIS_TEST_CLINIC_ID') or None
+
+    @property
+    def token(self) -> Optional[str]:
+        return self._token
+
+    @token.setter
+    def token(self, value: Optional[str]):
+        """Rotate the bearer token; the header is set on the client once rather than rebuilt per request"""
+        self._token = value
+        if self.client is not None:
+            self._apply_auth_header()
+
+    def _apply_auth_header(self):
+        if self._token:
+            self.client.headers['Authorization'] = f'Bearer {self._token}'
+        else:
+            self.client.headers.pop('Authorization', None)
+
+    def setup_steps(self) -> list:
+        """Serial setup that later tests depend on; the first step gates the rest of the run"""
+        steps = [self.test_user_login] if self._skip_registration else [self.test_user_registration, self.test_user_login]
+        if not self.clinic_id:
+            steps.append(self.test_create_clinic)
+        return steps
+
+    def build_client(self) -> httpx.AsyncClient:
+        """One HTTP/2 client multiplexes every (possibly concurrent) request"""
+        return httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=MAX_CONCURRENCY, max_keepalive_connections=MAX_CONCURRENCY),
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            headers={'Content-Type': 'application/json'},
+        )
 
     def log_test(self, name: str, success: bool, details: str = ""):
-        """Log test results"""
+        """Record a test result in the buffered report"""
         self.tests_run += 1
         if success:
             self.tests_passed += 1
-            print(f"✅ {name} - PASSED {details}")
+            self._log.append(f"✅ {name} - PASSED {details}")
         else:
-            print(f"❌ {name} - FAILED {details}")
+            self._log.append(f"❌ {name} - FAILED {details}")
         return success
 
-    def make_request(self, method: str, endpoint: str, data: Optional[Dict] = None, 
-                    params: Optional[Dict] = None, expected_status: int = 200) -> tuple[bool, Dict]:
-        """Make HTTP request with error handling"""
-        url = f"{self.api_url}{endpoint}"
-        headers = {'Content-Type': 'application/json'}
-        
-        if self.token:
-            headers['Authorization'] = f'Bearer {self.token}'
+    def flush_log(self):
+        """Write the buffered report in a single call"""
+        if self._log:
+            sys.stdout.write('\n'.join(self._log) + '\n')
+            sys.stdout.flush()
+            self._log.clear()
 
-        try:
-            if method == 'GET':
-                response = requests.get(url, headers=headers, params=params)
-            elif method == 'POST':
-                response = requests.post(url, json=data, headers=headers, params=params)
-            elif method == 'PUT':
-                response = requests.put(url, json=data, headers=headers, params=params)
-            elif method == 'DELETE':
-                response = requests.delete(url, headers=headers)
-            else:
-                return False, {"error": f"Unsupported method: {method}"}
+    async def make_request(self, method: str, endpoint: str, data: Optional[Dict] = None, 
+                    params: Optional[Dict] = None, expected_status: int = 200,
+                    read_timeout: float = READ_TIMEOUT,
+                    keys: Optional[Tuple[str, ...]] = None) -> tuple[bool, Dict]:
+        """Make HTTP request with error handling
+
+        Timeouts and 5xx responses are retried only for idempotent methods; a POST is
+        re-sent only after a 429 or when the connection was never established.
+
+        When `keys` is given the body is streamed and only those top-level keys are kept,
+        so large document payloads are never held in memory whole.
+        With ACC_CACHE=1, GETs are served from the local cache and writes invalidate
+        everything cached under the same top-level resource.
+        """
+        # Everything the retry loop needs is resolved once up front
+        url = self.api_url + endpoint
+        timeout = httpx.Timeout(read_timeout, connect=CONNECT_TIMEOUT)
+        body = orjson.dumps(data) if data is not None else None
+        stream = self.client.stream
+        slots = self._slots
+        scope = endpoint.split('/')[1]
+        idempotent = method in IDEMPOTENT_METHODS
+        
+        cache_key = None
+        if self.cache is not None and method == 'GET':
+            cache_key = self.cache.key(self.test_user['email'], url, params, keys)
+            cached = self.cache.lookup(cache_key)
+            if cached is not None:
+                return True, cached
+            cache_generation = self.cache.generation(scope)
 
-            success = response.status_code == expected_status
+        for attempt in range(MAX_ATTEMPTS):
+            final_attempt = attempt == MAX_ATTEMPTS - 1
+            attempts = f"{attempt + 1} attempt{'s' if attempt else ''}"
             try:
-                response_data = response.json() if response.content else {}
-            except:
-                response_data = {"raw_response": response.text}
+                # A slot is held only while the request is in flight, never across a backoff sleep
+                async with slots, stream(method, url, params=params, timeout=timeout, content=body) as response:
+                    
+                    # Other 4xx responses are not transient, so they fail fast without a retry
+                    retryable = response.status_code in RETRY_STATUSES and (idempotent or response.status_code == 429)
+                    if not retryable or final_attempt:
+                        # Error bodies are often HTML pages; report a prefix rather than decoding them
+                        if response.status_code != expected_status:
+                            return False, {
+                                "status_code": response.status_code,
+                                "expected_status": expected_status,
+                                "snippet": await read_snippet(response)
+                            }
+                        
+                        if keys:
+                            response_data = await read_top_level_keys(response, keys)
+                        else:
+                            await response.aread()
+                            response_data = orjson.loads(response.content) if response.content else {}
+                        
+                        if cache_key is not None:
+                            self.cache.store(cache_key, scope, response_data, cache_generation)
+                        elif self.cache is not None and method != 'GET':
+                            self.cache.invalidate(scope)
+                        return True, response_data
+                    
+                    retry_after = response.headers.get('Retry-After')
                 
-            if not success:
-                response_data["status_code"] = response.status_code
-                response_data["expected_status"] = expected_status
-                
-            return success, response_data
+            except NOT_SENT_ERRORS as e:
+                if final_attempt:
+                    return False, {"error": f"{str(e)} after {attempts}"}
+                retry_after = None
+            except httpx.TimeoutException:
+                if final_attempt or not idempotent:
+                    return False, {"error": f"Timed out after {attempts}"}
+                retry_after = None
+            except httpx.TransportError as e:
+                if final_attempt or not idempotent:
+                    return False, {"error": str(e)}
+                retry_after = None
+            except Exception as e:
+                return False, {"error": str(e)}
             
-        except Exception as e:
-            return False, {"error": str(e)}
+            await asyncio.sleep(backoff_delay(attempt, retry_after))
 
-    def test_user_registration(self) -> bool:
+    async def test_user_registration(self) -> bool:
         """Test user registration"""
-        success, response = self.make_request('POST', '/auth/register', self.test_user, expected_status=200)
+        success, response = await self.make_request('POST', '/auth/register', self.test_user, expected_status=200)
         
         if success and 'access_token' in response:
             self.token = response['access_token']
@@ -89,14 +312,14 @@ class AccredisAPITester:
         else:
             return self.log_test("User Registration", False, f"- {response}")
 
-    def test_user_login(self) -> bool:
+    async def test_user_login(self) -> bool:
         """Test user login"""
         login_data = {
             "email": self.test_user["email"],
             "password": self.test_user["password"]
         }
         
-        success, response = self.make_request('POST', '/auth/login', login_data, expected_status=200)
+        success, response = await self.make_request('POST', '/auth/login', login_data, expected_status=200)
         
         if success and 'access_token' in response:
             self.token = response['access_token']
@@ -105,27 +328,27 @@ class AccredisAPITester:
         else:
             return self.log_test("User Login", False, f"- {response}")
 
-    def test_get_current_user(self) -> bool:
-        """Test getting current user info"""
-        success, response = self.make_request('GET', '/auth/me', expected_status=200)
+    async def test_get_current_user(self) -> bool:
+        """Test the /auth/me contract against the user returned at login"""
+        success, response = await self.make_request('GET', '/auth/me', expected_status=200)
         
-        if success and 'email' in response:
+        if success and response.get('email') == self.user_data['email']:
             return self.log_test("Get Current User", True, f"- Email: {response['email']}")
         else:
             return self.log_test("Get Current User", False, f"- {response}")
 
-    def test_create_clinic(self) -> bool:
+    async def test_create_clinic(self) -> bool:
         """Test clinic creation"""
         clinic_data = {
-            "name": f"Test Clinic {self.test_timestamp}",
+            "name": f"Test Clinic {self.run_id}",
             "abn": "12 345 678 901",
             "address": "123 Test Street, Sydney NSW 2000",
             "state": "NSW",
             "phone": "(02) 1234 5678",
-            "email": f"clinic{self.test_timestamp}@example.com"
+            "email": f"clinic{self.run_id}@example.com"
         }
         
-        success, response = self.make_request('POST', '/clinics', clinic_data, expected_status=200)
+        success, response = await self.make_request('POST', '/clinics', clinic_data, expected_status=200)
         
         if success and 'id' in response:
             self.clinic_id = response['id']
@@ -133,28 +356,25 @@ class AccredisAPITester:
         else:
             return self.log_test("Create Clinic", False, f"- {response}")
 
-    def test_get_clinics(self) -> bool:
+    async def test_get_clinics(self) -> bool:
         """Test getting user clinics"""
-        success, response = self.make_request('GET', '/clinics', expected_status=200)
+        success, response = await self.make_request('GET', '/clinics', expected_status=200)
         
         if success and isinstance(response, list):
             return self.log_test("Get Clinics", True, f"- Found {len(response)} clinics")
         else:
             return self.log_test("Get Clinics", False, f"- {response}")
 
-    def test_get_clinic_by_id(self) -> bool:
+    async def test_get_clinic_by_id(self) -> bool:
         """Test getting specific clinic"""
-        if not self.clinic_id:
-            return self.log_test("Get Clinic by ID", False, "- No clinic ID available")
-            
-        success, response = self.make_request('GET', f'/clinics/{self.clinic_id}', expected_status=200)
+        success, response = await self.make_request('GET', f'/clinics/{self.clinic_id}', expected_status=200)
         
         if success and 'name' in response:
             return self.log_test("Get Clinic by ID", True, f"- Clinic: {response['name']}")
         else:
             return self.log_test("Get Clinic by ID", False, f"- {response}")
 
-    def test_save_settings(self) -> bool:
+    async def test_save_settings(self) -> bool:
         """Test saving settings (OpenAI API key)"""
         settings_data = {
             "openai_api_key": "sk-test-key-for-demo",
@@ -163,27 +383,24 @@ class AccredisAPITester:
             "audit_frequency": "monthly"
         }
         
-        success, response = self.make_request('POST', '/settings', settings_data, expected_status=200)
+        success, response = await self.make_request('POST', '/settings', settings_data, expected_status=200)
         
         if success:
             return self.log_test("Save Settings", True, "- Settings saved successfully")
         else:
             return self.log_test("Save Settings", False, f"- {response}")
 
-    def test_get_settings(self) -> bool:
+    async def test_get_settings(self) -> bool:
         """Test getting settings"""
-        success, response = self.make_request('GET', '/settings', expected_status=200)
+        success, response = await self.make_request('GET', '/settings', expected_status=200)
         
         if success and isinstance(response, dict):
             return self.log_test("Get Settings", True, f"- Settings retrieved")
         else:
             return self.log_test("Get Settings", False, f"- {response}")
 
-    def test_generate_document(self) -> bool:
+    async def test_generate_document(self) -> bool:
         """Test AI document generation"""
-        if not self.clinic_id:
-            return self.log_test("Generate Document", False, "- No clinic ID available")
-            
         doc_request = {
             "prompt": "Create a cold-chain policy for NSW clinics",
             "category": "policy",
@@ -191,7 +408,8 @@ class AccredisAPITester:
             "clinic_id": self.clinic_id
         }
         
-        success, response = self.make_request('POST', '/documents/generate', doc_request, expected_status=200)
+        success, response = await self.make_request('POST', '/documents/generate', doc_request, expected_status=200,
+                                                    read_timeout=AI_READ_TIMEOUT, keys=('id',))
         
         if success and 'id' in response:
             self.document_id = response['id']
@@ -199,65 +417,48 @@ class AccredisAPITester:
         else:
             return self.log_test("Generate Document", False, f"- {response}")
 
-    def test_get_documents(self) -> bool:
+    async def test_get_documents(self) -> bool:
         """Test getting documents"""
-        success, response = self.make_request('GET', '/documents', expected_status=200)
+        success, response = await self.make_request('GET', '/documents', expected_status=200)
         
         if success and isinstance(response, list):
             return self.log_test("Get Documents", True, f"- Found {len(response)} documents")
         else:
             return self.log_test("Get Documents", False, f"- {response}")
 
-    def test_get_document_by_id(self) -> bool:
-        """Test getting specific document"""
-        if not self.document_id:
-            return self.log_test("Get Document by ID", False, "- No document ID available")
-            
-        success, response = self.make_request('GET', f'/documents/{self.document_id}', expected_status=200)
+    async def test_get_document_by_id(self) -> bool:
+        """Test getting specific document after publishing; the status batch is its dependency"""
+        success, response = await self.make_request('GET', f'/documents/{self.document_id}', expected_status=200,
+                                                    keys=('title', 'status'))
         
-        if success and 'title' in response:
-            return self.log_test("Get Document by ID", True, f"- Document: {response['title']}")
+        if success and 'title' in response and response.get('status') == 'published':
+            return self.log_test("Get Document by ID", True, f"- Document: {response['title']} (published)")
         else:
             return self.log_test("Get Document by ID", False, f"- {response}")
 
-    def test_update_document_status(self) -> bool:
-        """Test updating document status (draft -> review -> published)"""
-        if not self.document_id:
-            return self.log_test("Update Document Status", False, "- No document ID available")
-        
-        # Test moving to review
-        success1, response1 = self.make_request('PUT', f'/documents/{self.document_id}/status', 
-                                               params={"status": "review"}, expected_status=200)
-        
-        if not success1:
-            return self.log_test("Update Document Status", False, f"- Failed to move to review: {response1}")
-        
-        # Test moving to published
-        success2, response2 = self.make_request('PUT', f'/documents/{self.document_id}/status', 
-                                               params={"status": "published"}, expected_status=200)
+    async def test_update_document_status(self) -> bool:
+        """Test updating document status (draft -> review -> published) in one batched request"""
+        success, response = await self.make_request('POST', f'/documents/{self.document_id}/status:batch',
+                                                    {"transitions": ["review", "published"]}, expected_status=200,
+                                                    keys=('status',))
         
-        if success2:
+        if success and response.get('status') == 'published':
             return self.log_test("Update Document Status", True, "- Draft → Review → Published")
         else:
-            return self.log_test("Update Document Status", False, f"- Failed to publish: {response2}")
+            return self.log_test("Update Document Status", False, f"- Failed to publish: {response}")
 
-    def test_audit_document(self) -> bool:
+    async def test_audit_document(self) -> bool:
         """Test document compliance audit"""
-        if not self.document_id:
-            return self.log_test("Audit Document", False, "- No document ID available")
-            
-        success, response = self.make_request('POST', f'/documents/{self.document_id}/audit', expected_status=200)
+        success, response = await self.make_request('POST', f'/documents/{self.document_id}/audit', expected_status=200,
+                                                    read_timeout=AI_READ_TIMEOUT, keys=('score',))
         
         if success and 'score' in response:
             return self.log_test("Audit Document", True, f"- Compliance Score: {response['score']}")
         else:
             return self.log_test("Audit Document", False, f"- {response}")
 
-    def test_create_risk(self) -> bool:
+    async def test_create_risk(self) -> bool:
         """Test creating a risk entry"""
-        if not self.clinic_id:
-            return self.log_test("Create Risk", False, "- No clinic ID available")
-            
         risk_data = {
             "title": "Test Clinical Risk",
             "description": "This is a test risk for clinical operations",
@@ -268,7 +469,7 @@ class AccredisAPITester:
             "clinic_id": self.clinic_id
         }
         
-        success, response = self.make_request('POST', '/risks', risk_data, expected_status=200)
+        success, response = await self.make_request('POST', '/risks', risk_data, expected_status=200)
         
         if success and 'id' in response:
             self.risk_id = response['id']
@@ -277,84 +478,239 @@ class AccredisAPITester:
         else:
             return self.log_test("Create Risk", False, f"- {response}")
 
-    def test_get_risks(self) -> bool:
+    async def test_get_risks(self) -> bool:
         """Test getting risks"""
-        success, response = self.make_request('GET', '/risks', expected_status=200)
+        success, response = await self.make_request('GET', '/risks', expected_status=200)
         
         if success and isinstance(response, list):
             return self.log_test("Get Risks", True, f"- Found {len(response)} risks")
         else:
             return self.log_test("Get Risks", False, f"- {response}")
 
-    def test_file_upload(self) -> bool:
+    async def test_file_upload(self) -> bool:
         """Test file upload functionality"""
         # This is a simplified test - in a real scenario we'd upload actual files
         # For now, we'll just test that the endpoint exists and handles missing files appropriately
-        success, response = self.make_request('POST', '/documents/upload', expected_status=422)  # Expect validation error
+        success, response = await self.make_request('POST', '/documents/upload', expected_status=422)  # Expect validation error
         
-        if response.get('status_code') == 422:
+        if success:
             return self.log_test("File Upload Endpoint", True, "- Endpoint exists and validates input")
         else:
             return self.log_test("File Upload Endpoint", False, f"- Unexpected response: {response}")
 
-    def run_all_tests(self) -> int:
-        """Run all API tests"""
-        print("🚀 Starting Accredis Backend API Tests")
-        print("=" * 50)
+    def dependency_graph(self) -> List[Node]:
+        """Tests and the tests they depend on; the setup chain comes first"""
+        def node(fn, *deps) -> Node:
+            return Node(fn.__name__.removeprefix('test_'), deps, fn)
+        
+        nodes, previous = [], ()
+        for fn in self.setup_steps():
+            nodes.append(node(fn, *previous))
+            previous = (nodes[-1].name,)
+        clinic = nodes[-1].name
+        
+        return nodes + [
+            node(self.test_get_current_user, 'user_login'),
+            node(self.test_get_clinics, 'user_login'),
+            node(self.test_save_settings, 'user_login'),
+            node(self.test_get_settings, 'user_login'),
+            node(self.test_get_documents, 'user_login'),
+            node(self.test_get_risks, 'user_login'),
+            node(self.test_file_upload, 'user_login'),
+            node(self.test_get_clinic_by_id, clinic),
+            node(self.test_create_risk, clinic),
+            node(self.test_generate_document, clinic, 'save_settings'),
+            node(self.test_update_document_status, 'generate_document'),
+            node(self.test_audit_document, 'generate_document'),
+            node(self.test_get_document_by_id, 'update_document_status'),
+        ]
+
+    async def run_graph(self, nodes: List[Node]):
+        """Start every test as soon as its dependencies pass; dependents of a failure are skipped, not run"""
+        tasks: Dict[str, asyncio.Task] = {}
+        
+        async def run_node(node: Node) -> bool:
+            results = [await tasks[dep] for dep in node.deps]
+            if not all(results):
+                failed = ', '.join(dep for dep, ok in zip(node.deps, results) if not ok)
+                self.tests_skipped += 1
+                self._log.append(f"⏭️ {node.name} - SKIPPED (needs {failed})")
+                return False
+            return await node.fn()
+        
+        for node in nodes:
+            tasks[node.name] = asyncio.create_task(run_node(node))
+        await asyncio.gather(*tasks.values())
+
+    async def run_all_tests(self) -> int:
+        """Run all API tests, each one as soon as the tests it depends on have passed"""
+        self._log.append("🚀 Starting Accredis Backend API Tests")
+        self._log.append("=" * 50)
         
-        # Authentication Tests
-        print("\n📝 Authentication Tests")
-        if not self.test_user_registration():
-            print("❌ Registration failed - stopping tests")
-            return 1
+        # The buffered report is written even if a test raises
+        try:
+            async with self.build_client() as self.client:
+                self._apply_auth_header()
+                await self.run_graph(self.dependency_graph())
             
-        self.test_user_login()
-        self.test_get_current_user()
-        
-        # Clinic Management Tests
-        print("\n🏥 Clinic Management Tests")
-        self.test_create_clinic()
-        self.test_get_clinics()
-        self.test_get_clinic_by_id()
-        
-        # Settings Tests
-        print("\n⚙️ Settings Tests")
-        self.test_save_settings()
-        self.test_get_settings()
-        
-        # Document Management Tests
-        print("\n📄 Document Management Tests")
-        self.test_generate_document()
-        self.test_get_documents()
-        self.test_get_document_by_id()
-        self.test_update_document_status()
-        self.test_audit_document()
-        
-        # Risk Management Tests
-        print("\n⚠️ Risk Management Tests")
-        self.test_create_risk()
-        self.test_get_risks()
-        
-        # File Upload Tests
-        print("\n📁 File Upload Tests")
-        self.test_file_upload()
-        
-        # Summary
-        print("\n" + "=" * 50)
-        print(f"📊 Test Results: {self.tests_passed}/{self.tests_run} tests passed")
-        
-        if self.tests_passed == self.tests_run:
-            print("🎉 All tests passed! Backend is working correctly.")
-            return 0
-        else:
-            failed = self.tests_run - self.tests_passed
-            print(f"⚠️ {failed} tests failed. Please check the backend implementation.")
-            return 1
+            # Summary
+            self._log.append("\n" + "=" * 50)
+            self._log.append(f"📊 Test Results: {self.tests_passed}/{self.tests_run} tests passed")
+            if self.tests_skipped:
+                self._log.append(f"⏭️ {self.tests_skipped} tests skipped after a failed dependency")
+            
+            if self.tests_passed == self.tests_run and not self.tests_skipped:
+                self._log.append("🎉 All tests passed! Backend is working correctly.")
+                return 0
+            else:
+                failed = self.tests_run - self.tests_passed
+                self._log.append(f"⚠️ {failed} tests failed. Please check the backend implementation.")
+                return 1
+        finally:
+            self.flush_log()
+
+# Credentials and tokens never reach a cassette; recordings replay against the placeholders
+SCRUBBED_REQUEST_FIELDS = ('password',)
+SCRUBBED_RESPONSE_FIELDS = ('access_token',)
+
+def scrub_json_fields(body: bytes, fields: Tuple[str, ...]) -> bytes:
+    """Replace the values of top-level secret fields in a JSON object body"""
+    try:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return body
+    if not isinstance(payload, dict) or not any(field in payload for field in fields):
+        return body
+    return orjson.dumps({key: 'SCRUBBED' if key in fields else value for key, value in payload.items()})
+
+def build_vcr(tester: AccredisAPITester, record_mode: str) -> vcr.VCR:
+    """Cassette recorder that keeps recordings stable across runs"""
+    def scrub_request(request):
+        # Test users and clinics are named after the run ID; normalize it so requests match on replay
+        if request.body:
+            body = request.body if isinstance(request.body, bytes) else request.body.encode()
+            body = body.replace(tester.run_id.encode(), b'RUN_ID')
+            request.body = scrub_json_fields(body, SCRUBBED_REQUEST_FIELDS)
+        return request
+    
+    def scrub_response(response):
+        body = response['body']['string']
+        if body:
+            response['body']['string'] = scrub_json_fields(body, SCRUBBED_RESPONSE_FIELDS)
+        return response
+    
+    return vcr.VCR(
+        cassette_library_dir=str(CASSETTE_DIR),
+        record_mode=record_mode,
+        match_on=['method', 'scheme', 'host', 'path', 'query', 'body'],
+        filter_headers=['authorization'],
+        decode_compressed_response=True,
+        before_record_request=scrub_request,
+        before_record_response=scrub_response,
+    )
+
+# pytest entry points: `ACCREDIS_BASE_URL=... pytest -n auto backend_test.py` registers one user
+# and clinic per worker and shares them across that worker's tests
+
+def run(api: AccredisAPITester, coro):
+    return api.loop.run_until_complete(coro)
+
+@pytest.fixture(scope='session')
+def api():
+    """Logged-in tester with a clinic; the setup round-trips happen once per session"""
+    base_url = os.environ.get('ACCREDIS_BASE_URL')
+    if not base_url:
+        pytest.skip("ACCREDIS_BASE_URL is not set")
+    
+    tester = AccredisAPITester(base_url)
+    tester.loop = asyncio.new_event_loop()
+    tester.client = tester.build_client()
+    try:
+        for step in tester.setup_steps():
+            if not run(tester, step()):
+                pytest.fail(f"Session setup failed at {step.__name__}")
+        yield tester
+    finally:
+        run(tester, tester.client.aclose())
+        tester.flush_log()
+        tester.loop.close()
+
+@pytest.fixture(scope='session')
+def document(api):
+    """Generate one document for the session's document tests"""
+    if not run(api, api.test_generate_document()):
+        pytest.fail("Document generation failed")
+    return api.document_id
+
+@pytest.fixture(scope='session')
+def published(api, document):
+    """Publish the session's document once, for tests that check its mutated state"""
+    if not run(api, api.test_update_document_status()):
+        pytest.fail("Publishing the document failed")
+    return document
+
+def test_get_current_user(api):
+    assert run(api, api.test_get_current_user())
+
+def test_get_clinics(api):
+    assert run(api, api.test_get_clinics())
+
+def test_get_clinic_by_id(api):
+    assert run(api, api.test_get_clinic_by_id())
+
+def test_save_settings(api):
+    assert run(api, api.test_save_settings())
+
+def test_get_settings(api):
+    assert run(api, api.test_get_settings())
+
+def test_get_documents(api):
+    assert run(api, api.test_get_documents())
+
+def test_create_risk(api):
+    assert run(api, api.test_create_risk())
+
+def test_get_risks(api):
+    assert run(api, api.test_get_risks())
+
+def test_file_upload(api):
+    assert run(api, api.test_file_upload())
+
+def test_generate_document(document):
+    assert document
+
+def test_update_document_status(published):
+    assert published
+
+def test_get_document_by_id(api, published):
+    assert run(api, api.test_get_document_by_id())
+
+def test_audit_document(api, document):
+    assert run(api, api.test_audit_document())
+
+def test_read_top_level_keys_across_chunks():
+    """Keys are extracted from a body split mid-token across several stream chunks"""
+    body = orjson.dumps({"id": "doc-1", "content": "x" * 10_000, "title": "Cold chain", "status": "draft"})
+    
+    async def chunks():
+        for i in range(0, len(body), 7):
+            yield body[i:i + 7]
+    
+    response = httpx.Response(200, content=chunks())
+    found = asyncio.run(read_top_level_keys(response, ('id', 'title')))
+    assert found == {"id": "doc-1", "title": "Cold chain"}
 
 def main():
     """Main test runner"""
-    tester = AccredisAPITester()
-    return tester.run_all_tests()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--record', action='store_true',
+                        help='re-record every HTTP interaction instead of replaying saved cassettes')
+    args = parser.parse_args()
+    
+    tester = AccredisAPITester(os.environ.get('ACCREDIS_BASE_URL', DEFAULT_BASE_URL))
+    recorder = build_vcr(tester, record_mode='all' if args.record else 'new_episodes')
+    with recorder.use_cassette('backend_api.yaml'):
+        return asyncio.run(tester.run_all_tests())
 
 if __name__ == "__main__":
     sys.exit(main())
\ No newline at end of file
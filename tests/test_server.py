@@ -0,0 +1,94 @@
+"""
+Backend route tests against an in-memory MongoDB (mongomock-motor); no server or network needed
+"""
+
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'accredis_test')
+
+import llm_cache  # noqa: E402
+import server  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """App client bound to a fresh in-memory database; startup hooks are not run"""
+    database = AsyncMongoMockClient(tz_aware=True)['accredis_test']
+    monkeypatch.setattr(server, 'db', database)
+    llm_cache.init(database)
+    server._TOKEN_CACHE.clear()
+    return TestClient(server.app)
+
+
+def register(client: TestClient, email: str) -> dict:
+    """Register a user without a clinic and return their auth headers"""
+    response = client.post('/api/auth/register', json={
+        "email": email,
+        "password": "TestPass123!",
+        "first_name": "Test",
+        "last_name": "User",
+        "role": "manager"
+    })
+    assert response.status_code == 200, response.text
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+def create_clinic_with_document(client: TestClient, headers: dict, title: str) -> str:
+    """Create a clinic and insert a draft document into it directly, skipping AI generation"""
+    response = client.post('/api/clinics', headers=headers, json={
+        "name": "Owner Clinic",
+        "address": "1 Test Street, Sydney NSW 2000",
+        "state": "NSW"
+    })
+    assert response.status_code == 200, response.text
+
+    now = server.now_utc()
+    doc_id = server.new_id()
+    asyncio.run(server.db.documents.insert_one({
+        "id": doc_id,
+        "title": title,
+        "content": "# Cold chain policy\nKeep vaccines between 2 and 8 degrees.",
+        "category": "policy",
+        "jurisdiction": "NSW",
+        "clinic_id": response.json()['id'],
+        "status": "draft",
+        "version": 1,
+        "tags": [],
+        "created_by": "owner",
+        "created_at": now,
+        "updated_at": now
+    }))
+    return doc_id
+
+
+def test_clinicless_user_cannot_list_other_clinics_documents(client):
+    owner = register(client, "owner@example.com")
+    create_clinic_with_document(client, owner, "Secret")
+
+    outsider = register(client, "outsider@example.com")
+    response = client.get('/api/documents', headers=outsider)
+
+    assert response.status_code == 200
+    assert response.json() == []
+
+
+def test_signature_recomputes_from_stored_fields(client):
+    owner = register(client, "owner@example.com")
+    doc_id = create_clinic_with_document(client, owner, "Cold chain policy")
+
+    response = client.post(f'/api/documents/{doc_id}/status:batch', headers=owner,
+                           json={"transitions": ["review", "published"]})
+    assert response.status_code == 200, response.text
+
+    doc = asyncio.run(server.db.documents.find_one({"id": doc_id}))
+    recomputed = server.create_document_hash(doc["content"], doc["signed_by"], doc["signed_at"], doc["signature_algo"])
+    assert recomputed == doc["signature_hash"]